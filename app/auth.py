@@ -1,32 +1,59 @@
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app.models import User
+from app.models import User, uuid7
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import hashlib
+import hmac
 import os
+import uuid
 
 security = HTTPBearer()
 
+class AuthenticatedUser(NamedTuple):
+    """Lightweight, session-independent view of the authenticated user"""
+    id: uuid.UUID
+    email: str
+    organization_id: Optional[uuid.UUID]
+
+# api_key_hash -> AuthenticatedUser; avoids a users SELECT on every request
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+# Read once at import; the salt is fixed for the life of the process
+_SALT = os.getenv("API_KEY_HASH_SALT", "default-salt")
+
+@lru_cache(maxsize=4096)
+def _hashed(api_key: str, salt: str) -> str:
+    """Memoized salted SHA-256 (live API keys are few and long-lived)"""
+    return hashlib.sha256(f"{api_key}{salt}".encode()).hexdigest()
+
 def hash_api_key(api_key: str) -> str:
     """Hash API key for storage"""
-    salt = os.getenv("API_KEY_HASH_SALT", "default-salt")
-    return hashlib.sha256(f"{api_key}{salt}".encode()).hexdigest()
+    return _hashed(api_key, _SALT)
 
 def verify_api_key(api_key: str, hashed_key: str) -> bool:
     """Verify API key against hash"""
-    return hash_api_key(api_key) == hashed_key
+    return hmac.compare_digest(hash_api_key(api_key), hashed_key)
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> User:
+) -> AuthenticatedUser:
     """Get current user from API key"""
-    api_key = credentials.credentials
+    api_key_hash = hash_api_key(credentials.credentials)
+    
+    cached = _user_cache.get(api_key_hash)
+    if cached is not None:
+        return cached
     
     # Find user by API key hash
     user = db.query(User).filter(
-        User.api_key_hash == hash_api_key(api_key)
+        User.api_key_hash == api_key_hash
     ).first()
     
     if not user:
@@ -35,26 +62,34 @@ async def get_current_user(
             detail="Invalid API key"
         )
     
-    return user
+    authenticated = AuthenticatedUser(user.id, user.email, user.organization_id)
+    _user_cache[api_key_hash] = authenticated
+    return authenticated
 
 def create_user(email: str, api_key: str, db: Session) -> User:
     """Create a new user"""
-    # Check if user already exists
-    existing_user = db.query(User).filter(User.email == email).first()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User already exists"
-        )
-    
-    # Create new user
+    # Create new user; id and created_at are set client-side so the row
+    # doesn't need to be reloaded after the insert
+    api_key_hash = hash_api_key(api_key)
     user = User(
+        id=uuid7(),
         email=email,
-        api_key_hash=hash_api_key(api_key)
+        api_key_hash=api_key_hash,
+        created_at=datetime.now(timezone.utc)
     )
     
+    # The unique constraint on email rejects duplicates in the same round-trip
+    # (and without the check-then-insert race)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User already exists"
+        )
+    
+    _user_cache.pop(api_key_hash, None)
     
     return user
@@ -1,37 +1,91 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.models import Request, ProviderCost
+from app.database import SessionLocal
+from app.models import Request, ProviderCost, uuid7
+from app.request_logger import enqueue_request_log
 from app.schemas import ChatCompletionRequest, EmbeddingRequest
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import logging
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Column widths; user-supplied values are clipped so one oversized row can't
+# fail a whole batch insert
+_PROVIDER_LEN = Request.__table__.c.provider.type.length
+_MODEL_LEN = Request.__table__.c.model.type.length
+
+# Statuses whose cost counts against the user's credits; a stream the client
+# abandoned was still generated (and billed) upstream
+BILLABLE_STATUSES = ("success", "client_disconnected")
+
+# (provider, model) -> (input, output) micro-dollars per token, reloaded every PRICING_TTL seconds
+PRICING_TTL = 300  # seconds
+_DEFAULT_PRICING = {
+    "vercel": (1000, 2000),
+    "openai": (1000, 2000),
+    "anthropic": (3000, 15000)
+}
+_pricing: Dict[Tuple[str, str], Tuple[float, float]] = {}
+_pricing_loaded_at = float("-inf")
+
+def load_pricing(db: Session) -> Dict[Tuple[str, str], Tuple[float, float]]:
+    """Reload the pricing table from the database"""
+    global _pricing, _pricing_loaded_at
+    rows = db.query(
+        ProviderCost.provider,
+        ProviderCost.model,
+        ProviderCost.input_micro_usd_per_1k,
+        ProviderCost.output_micro_usd_per_1k
+    ).order_by(ProviderCost.effective_date).all()
+    
+    # Later effective dates overwrite earlier ones
+    _pricing = {
+        (provider, model): (input_cost / 1000, output_cost / 1000)
+        for provider, model, input_cost, output_cost in rows
+    }
+    _pricing_loaded_at = time.monotonic()
+    return _pricing
+
+def _reload_pricing() -> None:
+    """Reload pricing on a session of its own (runs in a worker thread)"""
+    db = SessionLocal()
+    try:
+        load_pricing(db)
+    finally:
+        db.close()
+
+async def refresh_pricing() -> None:
+    """Reload the pricing table if it is older than PRICING_TTL; failures keep the current table"""
+    global _pricing_loaded_at
+    if time.monotonic() - _pricing_loaded_at <= PRICING_TTL:
+        return
+    
+    # Claim the reload up front so concurrent callers don't pile on, and so a
+    # failing database is retried once per TTL rather than on every request
+    _pricing_loaded_at = time.monotonic()
+    try:
+        await asyncio.to_thread(_reload_pricing)
+    except Exception:
+        logger.exception("Failed to reload pricing; keeping the current table")
 
 class CostTracker:
     def __init__(self, db: Session):
         self.db = db
     
-    def calculate_cost(self, provider: str, model: str, input_tokens: int, output_tokens: int) -> float:
-        """Calculate cost based on provider pricing"""
-        # Get pricing from database
-        pricing = self.db.query(ProviderCost).filter(
-            ProviderCost.provider == provider,
-            ProviderCost.model == model
-        ).first()
-        
-        if not pricing:
-            # Default pricing if not found in database
-            default_pricing = {
-                "vercel": {"input": 0.001, "output": 0.002},
-                "openai": {"input": 0.001, "output": 0.002},
-                "anthropic": {"input": 0.003, "output": 0.015}
-            }
-            input_cost = default_pricing.get(provider, {}).get("input", 0.001)
-            output_cost = default_pricing.get(provider, {}).get("output", 0.002)
-        else:
-            input_cost = float(pricing.input_cost_per_1k) / 1000
-            output_cost = float(pricing.output_cost_per_1k) / 1000
+    def calculate_cost(self, provider: str, model: str, input_tokens: int, output_tokens: int) -> int:
+        """Calculate cost in micro-dollars from the cached pricing table (see refresh_pricing)"""
+        # Default pricing if not found in database
+        input_cost, output_cost = (
+            _pricing.get((provider, model))
+            or _DEFAULT_PRICING.get(provider, (1000, 2000))
+        )
         
         total_cost = (input_tokens * input_cost) + (output_tokens * output_cost)
-        return round(total_cost, 6)
+        return round(total_cost)
     
     def log_request(
         self,
@@ -43,61 +97,55 @@ class CostTracker:
         input_tokens: Optional[int],
         output_tokens: Optional[int],
         total_tokens: Optional[int],
-        cost_usd: Optional[float],
+        cost_micro_usd: Optional[int],
         latency_ms: Optional[int],
         status: str,
-        error_message: Optional[str] = None
+        error_message: Optional[str] = None,
+        request_id: Optional[uuid.UUID] = None
     ) -> uuid.UUID:
-        """Log a request to the database"""
-        request = Request(
-            user_id=user_id,
-            organization_id=organization_id,
-            provider=provider,
-            model=model,
-            request_type=request_type,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens,
-            cost_usd=cost_usd,
-            latency_ms=latency_ms,
-            status=status,
-            error_message=error_message
-        )
-        
-        self.db.add(request)
-        self.db.commit()
-        self.db.refresh(request)
+        """Queue a request log for the background writer and return its ID"""
+        request_id = request_id or uuid7()
+        enqueue_request_log({
+            "id": request_id,
+            "user_id": user_id,
+            "organization_id": organization_id,
+            "provider": provider[:_PROVIDER_LEN],
+            "model": model[:_MODEL_LEN],
+            "request_type": request_type,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens,
+            "cost_micro_usd": cost_micro_usd,
+            "latency_ms": latency_ms,
+            "status": status,
+            "error_message": error_message,
+            # Stamp now rather than at flush time
+            "created_at": datetime.now(timezone.utc)
+        })
         
-        return request.id
+        return request_id
     
     def get_user_credits(self, user_id: uuid.UUID) -> Dict[str, Any]:
         """Get user's credit balance and usage"""
-        # Calculate total used
-        total_used = self.db.query(Request).filter(
-            Request.user_id == user_id,
-            Request.status == "success"
-        ).with_entities(Request.cost_usd).all()
-        
-        total_cost = sum(float(cost[0]) for cost in total_used if cost[0])
-        
-        # Calculate usage breakdown by provider
+        # Aggregate per provider in the database; the total is summed over
+        # the (small) grouped result
         provider_usage = self.db.query(
             Request.provider,
-            Request.cost_usd
+            func.sum(Request.cost_micro_usd)
         ).filter(
             Request.user_id == user_id,
-            Request.status == "success"
-        ).all()
+            Request.status.in_(BILLABLE_STATUSES)
+        ).group_by(Request.provider).all()
         
-        usage_breakdown = {}
-        for provider, cost in provider_usage:
-            if cost:
-                if provider not in usage_breakdown:
-                    usage_breakdown[provider] = 0
-                usage_breakdown[provider] += float(cost)
+        # SUM(bigint) comes back as numeric (Decimal on Postgres), so keep the
+        # arithmetic in int micro-dollars and convert only for display
+        usage_breakdown = {
+            provider: int(cost) for provider, cost in provider_usage if cost
+        }
+        total_cost = sum(usage_breakdown.values()) / 1_000_000
         
         # Convert to strings for API response
-        usage_breakdown_str = {k: f"{v:.2f}" for k, v in usage_breakdown.items()}
+        usage_breakdown_str = {k: f"{v / 1_000_000:.2f}" for k, v in usage_breakdown.items()}
         
         return {
             "balance": f"{100.00 - total_cost:.2f}",  # Assume $100 starting balance
@@ -114,8 +162,8 @@ class CostTracker:
         
         return {
             "id": str(request.id),
-            "total_cost": float(request.cost_usd) if request.cost_usd else 0,
-            "usage": float(request.cost_usd) if request.cost_usd else 0,
+            "total_cost": request.cost_usd or 0,
+            "usage": request.cost_usd or 0,
             "created_at": request.created_at.isoformat(),
             "model": request.model,
             "provider_name": request.provider,
@@ -0,0 +1,13 @@
+import functools
+import httpx
+
+@functools.cache
+def get_shared_client() -> httpx.AsyncClient:
+    """One pooled upstream client shared by all providers, created on first use"""
+    # Sharing it means keep-alive connections (and their TLS sessions) are
+    # reused across requests; deferring it keeps SSL setup out of import time
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    )
@@ -1,66 +1,79 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from app.database import get_db, engine
-from app.models import Base
+from app.database import get_db, engine, SessionLocal
+from app.models import Base, uuid7
+from app.migrations import upgrade_schema
 from app.schemas import (
-    ChatCompletionRequest, ChatCompletionResponse,
-    EmbeddingRequest, EmbeddingResponse,
+    ChatCompletionRequest,
+    EmbeddingRequest,
     ModelsResponse, CreditsResponse,
     UserCreate, UserResponse
 )
 from app.router import ProviderRouter
-from app.cost_tracker import CostTracker
-from app.auth import get_current_user, create_user
-from app.models import User
+from app.cost_tracker import CostTracker, load_pricing, refresh_pricing
+from app.request_logger import run_request_log_writer, flush_request_log
+from app.auth import get_current_user, create_user, AuthenticatedUser
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from cachetools import TTLCache
 import uuid
 import time
 import os
-import json
+import orjson
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="AI Gateway",
     description="OpenAI-compatible AI Gateway with cost tracking",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log all incoming requests for debugging"""
-    if request.url.path.startswith("/v1/"):
-        body = await request.body()
-        print(f"\n🔍 Incoming Request to {request.url.path}")
-        print(f"   Method: {request.method}")
-        print(f"   Headers: {dict(request.headers)}")
-        if body:
-            try:
-                body_json = json.loads(body)
-                print(f"   Body: {json.dumps(body_json, indent=2)}")
-            except:
-                print(f"   Body (raw): {body.decode()}")
-        
-        # Important: Re-create request with body for downstream processing
-        async def receive():
-            return {"type": "http.request", "body": body}
-        
-        request._receive = receive
+    """Log incoming API requests at DEBUG level"""
+    if logger.isEnabledFor(logging.DEBUG) and request.url.path.startswith("/v1/"):
+        logger.debug("req %s %s", request.method, request.url.path)
     
-    response = await call_next(request)
-    return response
+    return await call_next(request)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database tables on startup"""
     try:
         Base.metadata.create_all(bind=engine)
+        upgrade_schema(engine)
         print("✅ Database tables initialized successfully!")
+        db = SessionLocal()
+        try:
+            load_pricing(db)
+        finally:
+            db.close()
         print("✅ AI Gateway startup completed!")
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
         print("⚠️ Continuing startup without database...")
         # Don't fail startup, let the app run and handle DB errors gracefully
+    
+    app.state.request_log_writer = asyncio.create_task(run_request_log_writer())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued request logs and close the upstream HTTP client"""
+    app.state.request_log_writer.cancel()
+    try:
+        await app.state.request_log_writer
+    except asyncio.CancelledError:
+        pass
+    # Give abandoned streams a moment to finish costing before the final flush
+    if _stream_finishers:
+        await asyncio.wait(_stream_finishers, timeout=STREAM_FINISH_TIMEOUT)
+    await flush_request_log()
+    await router.close()
 
 # Add CORS middleware
 app.add_middleware(
@@ -71,7 +84,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize router
+# Initialize router (providers are created lazily on the shared HTTP client)
 router = ProviderRouter()
 
 @app.get("/")
@@ -92,116 +105,217 @@ async def debug_streaming():
         "timestamp": time.time()
     }
 
-@app.post("/v1/chat/completions")
+def _estimate_usage(request: ChatCompletionRequest, completion_chars: int) -> Dict[str, int]:
+    """Rough (~4 chars per token) usage for a stream cut off before its usage chunk"""
+    prompt_chars = sum(len(msg.content) for msg in request.messages if isinstance(msg.content, str))
+    prompt_tokens = -(-prompt_chars // 4)
+    completion_tokens = -(-completion_chars // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+# Each stream is closed out and logged by one of these tasks (draining the
+# upstream first if the client left); kept referenced so they aren't GC'd
+STREAM_FINISH_TIMEOUT = 5  # seconds to wait for them on shutdown
+_stream_finishers: "set[asyncio.Task]" = set()
+
+async def _finish_stream(
+    stream: AsyncIterator[str],
+    next_line: "Optional[asyncio.Future[Optional[str]]]",
+    cost_tracker: CostTracker,
+    current_user: AuthenticatedUser,
+    request_id: uuid.UUID,
+    provider: str,
+    request: ChatCompletionRequest,
+    usage: Dict[str, Any],
+    completion_chars: int,
+    latency_ms: int,
+    request_status: str,
+    error_message: Optional[str]
+):
+    """Close out an upstream stream and log it, reading on for usage if the client left early"""
+    try:
+        if request_status == "client_disconnected" and not usage:
+            # The upstream is still generating (and billing) the completion;
+            # its final chunk carries the real usage
+            line = await next_line if next_line is not None else await anext(stream, None)
+            while line is not None:
+                if line.startswith("data: ") and line != "data: [DONE]":
+                    chunk = orjson.loads(line[6:])
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                line = await anext(stream, None)
+    except Exception:
+        logger.warning("Failed to drain abandoned stream %s", request_id, exc_info=True)
+    finally:
+        await stream.aclose()
+    
+    if request_status == "client_disconnected" and not usage:
+        usage = _estimate_usage(request, completion_chars)
+    
+    await _persist_usage(
+        cost_tracker,
+        current_user,
+        request_id,
+        provider=provider,
+        model=request.model,
+        request_type="chat_stream",
+        usage=usage,
+        latency_ms=latency_ms,
+        request_status=request_status,
+        error_message=error_message
+    )
+
+async def _persist_usage(
+    cost_tracker: CostTracker,
+    current_user: AuthenticatedUser,
+    request_id: uuid.UUID,
+    provider: str,
+    model: str,
+    request_type: str,
+    usage: Dict[str, Any],
+    latency_ms: Optional[int],
+    request_status: str = "success",
+    error_message: Optional[str] = None
+):
+    """Cost a completed request from its usage block and queue its log row"""
+    # Async so the log queue is always fed from the event loop thread
+    await refresh_pricing()
+    input_tokens = usage.get("prompt_tokens", 0)
+    output_tokens = usage.get("completion_tokens", 0)
+    cost_tracker.log_request(
+        user_id=current_user.id,
+        organization_id=current_user.organization_id,
+        provider=provider,
+        model=model,
+        request_type=request_type,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        total_tokens=usage.get("total_tokens", 0),
+        cost_micro_usd=cost_tracker.calculate_cost(provider, model, input_tokens, output_tokens),
+        latency_ms=latency_ms,
+        status=request_status,
+        error_message=error_message,
+        request_id=request_id
+    )
+
+@app.post("/v1/chat/completions", response_model=None)
 async def chat_completions(
     request: ChatCompletionRequest,
-    current_user: User = Depends(get_current_user),
+    background_tasks: BackgroundTasks,
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """OpenAI-compatible chat completions endpoint"""
-    # Debug logging
-    print(f"📝 Received chat completion request:")
-    print(f"   Model: {request.model}")
-    print(f"   Messages: {len(request.messages)} message(s)")
-    print(f"   Temperature: {request.temperature}")
-    print(f"   Max tokens: {request.max_tokens}")
-    print(f"   Stream: {request.stream}")
+    logger.debug(
+        "chat completion: model=%s messages=%d temperature=%s max_tokens=%s stream=%s",
+        request.model, len(request.messages), request.temperature,
+        request.max_tokens, request.stream
+    )
     
     cost_tracker = CostTracker(db)
     
     # Handle streaming response first
     if request.stream:
-        print("🌊 Processing streaming response")
-        print(f"🔍 Request stream flag: {request.stream}")
-        from fastapi.responses import StreamingResponse
-        import json
-        import asyncio
-        
-        # Convert streaming request to non-streaming for provider
-        print("⚠️ Converting streaming request to non-streaming for compatibility")
-        request.stream = False
-        
-        # Get non-streaming response first
-        result = await router.chat_completion(request)
-        
-        # Extract usage information
-        usage = result.get("usage", {})
-        input_tokens = usage.get("prompt_tokens", 0)
-        output_tokens = usage.get("completion_tokens", 0)
-        total_tokens = usage.get("total_tokens", 0)
-        
-        # Calculate cost
-        provider = result.get("providerMetadata", {}).get("gateway", {}).get("provider", "unknown")
-        cost = cost_tracker.calculate_cost(provider, request.model, input_tokens, output_tokens)
-        
-        # Log request
-        request_id = cost_tracker.log_request(
-            user_id=current_user.id,
-            organization_id=current_user.organization_id,
-            provider=provider,
-            model=request.model,
-            request_type="chat_stream",
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens,
-            cost_usd=cost,
-            latency_ms=result.get("providerMetadata", {}).get("gateway", {}).get("latency"),
-            status="success"
-        )
+        request_id = uuid7()
+        generation_id = f"gen_{request_id.hex}"
+        provider = router.select_provider(request.model)
+        start_ns = time.perf_counter_ns()
         
-        # Get the response content
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        stream = router.chat_completion_stream(request)
+        try:
+            # Pull the first line now so upstream errors fail the request
+            # before any response headers are sent
+            first_line = await anext(stream, None)
+        except Exception as e:
+            logger.exception("chat_completions stream failed to open")
+            cost_tracker.log_request(
+                user_id=current_user.id,
+                organization_id=current_user.organization_id,
+                provider=provider,
+                model=request.model,
+                request_type="chat_stream",
+                input_tokens=0,
+                output_tokens=0,
+                total_tokens=0,
+                cost_micro_usd=0,
+                latency_ms=0,
+                status="error",
+                error_message=str(e)
+            )
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Request failed: {str(e)}"
+            )
         
-        # Create streaming response
-        async def generate_stream():
-            # Send initial chunk
-            initial_chunk = {
-                "id": f"gen_{request_id.hex}",
-                "object": "chat.completion.chunk",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "delta": {"role": "assistant"},
-                    "finish_reason": None
-                }]
-            }
-            yield f"data: {json.dumps(initial_chunk)}\n\n"
-            
-            # Split content into words for streaming effect
-            words = content.split()
-            for i, word in enumerate(words):
-                chunk = {
-                    "id": f"gen_{request_id.hex}",
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": request.model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {"content": word + (" " if i < len(words) - 1 else "")},
-                        "finish_reason": None
-                    }]
-                }
-                yield f"data: {json.dumps(chunk)}\n\n"
-                await asyncio.sleep(0.05)  # Small delay for streaming effect
-            
-            # Send final chunk
-            final_chunk = {
-                "id": f"gen_{request_id.hex}",
-                "object": "chat.completion.chunk",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "delta": {},
-                    "finish_reason": "stop"
-                }]
-            }
-            yield f"data: {json.dumps(final_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+        async def relay_stream():
+            """Relay provider SSE lines, tagging chunks with our generation ID"""
+            usage = {}
+            completion_chars = 0
+            request_status = "error"
+            error_message = None
+            # In-flight upstream read; shielded so a client disconnect doesn't
+            # tear down the upstream before its usage chunk arrives
+            next_line = None
+            # Usage is always requested upstream for billing, but only passed
+            # on to clients that asked for it themselves
+            stream_options = (request.model_extra or {}).get("stream_options")
+            forward_usage = isinstance(stream_options, dict) and bool(stream_options.get("include_usage"))
+            try:
+                line = first_line
+                while line is not None:
+                    forward = True
+                    if line.startswith("data: ") and line != "data: [DONE]":
+                        chunk = orjson.loads(line[6:])
+                        chunk["id"] = generation_id
+                        # The final chunk carries usage for the whole stream
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        if not forward_usage and "usage" in chunk:
+                            del chunk["usage"]
+                            # A usage-only chunk has no choices, which clients
+                            # that didn't ask for usage don't expect
+                            forward = bool(chunk.get("choices"))
+                        for choice in chunk.get("choices") or ():
+                            completion_chars += len((choice.get("delta") or {}).get("content") or "")
+                        line = f"data: {orjson.dumps(chunk).decode()}"
+                    if forward:
+                        yield line + "\n"
+                    next_line = asyncio.ensure_future(anext(stream, None))
+                    line = await asyncio.shield(next_line)
+                    next_line = None
+                request_status = "success"
+            except (GeneratorExit, asyncio.CancelledError):
+                # Client disconnected; the completion is still billable
+                request_status = "client_disconnected"
+                raise
+            except Exception as e:
+                error_message = str(e)
+                raise
+            finally:
+                # Finish in a separate task: once the response is cancelled,
+                # any await here could be cancelled too and skip the log row
+                task = asyncio.create_task(_finish_stream(
+                    stream,
+                    next_line,
+                    cost_tracker,
+                    current_user,
+                    request_id,
+                    provider=provider,
+                    request=request,
+                    usage=usage,
+                    completion_chars=completion_chars,
+                    latency_ms=(time.perf_counter_ns() - start_ns) // 1_000_000,
+                    request_status=request_status,
+                    error_message=error_message
+                ))
+                _stream_finishers.add(task)
+                task.add_done_callback(_stream_finishers.discard)
         
         return StreamingResponse(
-            generate_stream(),
+            relay_stream(),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -214,44 +328,30 @@ async def chat_completions(
     try:
         # Route request to appropriate provider
         result = await router.chat_completion(request)
-        print(f"🔍 Provider result type: {type(result)}")
-        print(f"🔍 Provider result keys: {result.keys() if isinstance(result, dict) else 'Not a dict'}")
-        
-        # Extract usage information
-        usage = result.get("usage", {})
-        input_tokens = usage.get("prompt_tokens", 0)
-        output_tokens = usage.get("completion_tokens", 0)
-        total_tokens = usage.get("total_tokens", 0)
-        
-        # Calculate cost
-        provider = result.get("providerMetadata", {}).get("gateway", {}).get("provider", "unknown")
-        cost = cost_tracker.calculate_cost(provider, request.model, input_tokens, output_tokens)
         
-        # Log request
-        request_id = cost_tracker.log_request(
-            user_id=current_user.id,
-            organization_id=current_user.organization_id,
-            provider=provider,
+        # Cost and log after the response has been sent
+        gateway = (result.get("providerMetadata") or {}).get("gateway") or {}
+        request_id = uuid7()
+        background_tasks.add_task(
+            _persist_usage,
+            cost_tracker,
+            current_user,
+            request_id,
+            provider=gateway.get("provider", "unknown"),
             model=request.model,
             request_type="chat",
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens,
-            cost_usd=cost,
-            latency_ms=result.get("providerMetadata", {}).get("gateway", {}).get("latency"),
-            status="success"
+            usage=result.get("usage", {}),
+            latency_ms=gateway.get("latency")
         )
         
         # Add generation ID to response
         result["id"] = f"gen_{request_id.hex}"
         
-        return result
+        # The provider dict is already JSON-ready; skip jsonable_encoder
+        return ORJSONResponse(result)
         
     except Exception as e:
-        print(f"❌ Error processing request: {str(e)}")
-        print(f"   Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("chat_completions failed")
         
         # Log failed request
         try:
@@ -264,23 +364,24 @@ async def chat_completions(
                 input_tokens=0,
                 output_tokens=0,
                 total_tokens=0,
-                cost_usd=0,
+                cost_micro_usd=0,
                 latency_ms=0,
                 status="error",
                 error_message=str(e)
             )
         except Exception as log_error:
-            print(f"⚠️ Failed to log error: {log_error}")
+            logger.warning("Failed to log error: %s", log_error)
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Request failed: {str(e)}"
         )
 
-@app.post("/v1/embeddings", response_model=EmbeddingResponse)
+@app.post("/v1/embeddings", response_model=None)
 async def embeddings(
     request: EmbeddingRequest,
-    current_user: User = Depends(get_current_user),
+    background_tasks: BackgroundTasks,
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """OpenAI-compatible embeddings endpoint"""
@@ -290,31 +391,22 @@ async def embeddings(
         # Route request to appropriate provider
         result = await router.embedding(request)
         
-        # Extract usage information
-        usage = result.get("usage", {})
-        input_tokens = usage.get("prompt_tokens", 0)
-        total_tokens = usage.get("total_tokens", 0)
-        
-        # Calculate cost
-        provider = result.get("providerMetadata", {}).get("gateway", {}).get("provider", "unknown")
-        cost = cost_tracker.calculate_cost(provider, request.model, input_tokens, 0)
-        
-        # Log request
-        request_id = cost_tracker.log_request(
-            user_id=current_user.id,
-            organization_id=current_user.organization_id,
-            provider=provider,
+        # Cost and log after the response has been sent
+        gateway = (result.get("providerMetadata") or {}).get("gateway") or {}
+        background_tasks.add_task(
+            _persist_usage,
+            cost_tracker,
+            current_user,
+            uuid7(),
+            provider=gateway.get("provider", "unknown"),
             model=request.model,
             request_type="embedding",
-            input_tokens=input_tokens,
-            output_tokens=0,
-            total_tokens=total_tokens,
-            cost_usd=cost,
-            latency_ms=result.get("providerMetadata", {}).get("gateway", {}).get("latency"),
-            status="success"
+            usage=result.get("usage", {}),
+            latency_ms=gateway.get("latency")
         )
         
-        return result
+        # Embedding vectors make jsonable_encoder especially costly; skip it
+        return ORJSONResponse(result)
         
     except Exception as e:
         # Log failed request
@@ -327,7 +419,7 @@ async def embeddings(
             input_tokens=0,
             output_tokens=0,
             total_tokens=0,
-            cost_usd=0,
+            cost_micro_usd=0,
             latency_ms=0,
             status="error",
             error_message=str(e)
@@ -338,11 +430,29 @@ async def embeddings(
             detail=f"Request failed: {str(e)}"
         )
 
+# Upstream model list plus an id -> model index, refetched at most once per TTL
+MODELS_CACHE_TTL = 60  # seconds
+_models_cache: TTLCache = TTLCache(maxsize=1, ttl=MODELS_CACHE_TTL)
+_models_lock = asyncio.Lock()
+
+async def _get_models() -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Get the cached model list and its id index, fetching on expiry"""
+    cached = _models_cache.get("models")
+    if cached is None:
+        # Concurrent misses wait for a single upstream fetch
+        async with _models_lock:
+            cached = _models_cache.get("models")
+            if cached is None:
+                models = await router.get_models()
+                cached = (models, {model["id"]: model for model in models["data"]})
+                _models_cache["models"] = cached
+    return cached
+
 @app.get("/v1/models", response_model=ModelsResponse)
 async def list_models():
     """List available models from all providers"""
     try:
-        result = await router.get_models()
+        result, _ = await _get_models()
         return result
     except Exception as e:
         raise HTTPException(
@@ -354,10 +464,10 @@ async def list_models():
 async def get_model(model_id: str):
     """Get specific model information"""
     try:
-        models = await router.get_models()
-        for model in models["data"]:
-            if model["id"] == model_id:
-                return model
+        _, model_by_id = await _get_models()
+        model = model_by_id.get(model_id)
+        if model is not None:
+            return model
         
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -373,7 +483,7 @@ async def get_model(model_id: str):
 
 @app.get("/v1/credits", response_model=CreditsResponse)
 async def get_credits(
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get user's credit balance and usage"""
@@ -384,13 +494,13 @@ async def get_credits(
 @app.get("/v1/generation")
 async def get_generation(
     id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: AuthenticatedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get generation details by ID"""
     try:
-        # Convert string ID to UUID
-        generation_id = uuid.UUID(id.replace("gen_", ""))
+        # IDs are issued as gen_<hex>; only strip the leading prefix
+        generation_id = uuid.UUID(hex=id.removeprefix("gen_"))
         
         cost_tracker = CostTracker(db)
         generation = cost_tracker.get_generation_details(generation_id)
@@ -435,4 +545,13 @@ async def create_user_endpoint(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers need an import string rather than the app object
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        access_log=False
+    )
@@ -0,0 +1,58 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from app.models import Request
+import logging
+
+logger = logging.getLogger(__name__)
+
+# create_all() only creates missing tables; it never alters existing ones.
+# upgrade_schema() brings tables created by older versions up to date and is
+# safe to run on every startup.
+
+# Arbitrary key for the advisory lock that serializes concurrent workers
+_MIGRATION_LOCK_KEY = 712_004_201
+
+# (table, old DECIMAL dollars column, new BIGINT micro-dollars column, NOT NULL)
+_MICRO_USD_COLUMNS = (
+    ("requests", "cost_usd", "cost_micro_usd", False),
+    ("provider_costs", "input_cost_per_1k", "input_micro_usd_per_1k", True),
+    ("provider_costs", "output_cost_per_1k", "output_micro_usd_per_1k", True),
+)
+
+def _migrate_micro_usd_columns(conn: Connection) -> None:
+    """Convert DECIMAL dollar cost columns to BIGINT micro-dollars, preserving values"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    
+    for table, old, new, not_null in _MICRO_USD_COLUMNS:
+        if table not in existing_tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        if old not in columns:
+            continue
+        
+        logger.warning("Migrating %s.%s to %s", table, old, new)
+        if new not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {new} BIGINT"))
+        conn.execute(text(
+            f"UPDATE {table} SET {new} = CAST(ROUND({old} * 1000000) AS BIGINT) "
+            f"WHERE {new} IS NULL AND {old} IS NOT NULL"
+        ))
+        # On Postgres this also drops any index covering the old column;
+        # the indexes are recreated below
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {old}"))
+        if not_null and conn.dialect.name == "postgresql":
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {new} SET NOT NULL"))
+
+def upgrade_schema(engine: Engine) -> None:
+    """Apply in-place schema changes that create_all() can't make to existing tables"""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Held until commit, so parallel workers migrate one at a time
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+        
+        _migrate_micro_usd_columns(conn)
+        
+        # Indexes added after the requests table was first created
+        for index in Request.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
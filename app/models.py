@@ -1,13 +1,23 @@
-from sqlalchemy import Column, String, Integer, DateTime, DECIMAL, Text, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Text, Boolean, Index
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
+import os
+import time
 import uuid
 from app.database import Base
 
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 v7) so new primary keys append to the B-tree"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     email = Column(String(255), unique=True, nullable=False)
     api_key_hash = Column(String(255), unique=True, nullable=False)
     organization_id = Column(UUID(as_uuid=True), nullable=True)
@@ -17,7 +27,7 @@ class User(Base):
 class Organization(Base):
     __tablename__ = "organizations"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String(255), nullable=False)
     billing_email = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -26,7 +36,7 @@ class Organization(Base):
 class Request(Base):
     __tablename__ = "requests"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     user_id = Column(UUID(as_uuid=True), nullable=True)
     organization_id = Column(UUID(as_uuid=True), nullable=True)
     provider = Column(String(50), nullable=False)
@@ -35,19 +45,46 @@ class Request(Base):
     input_tokens = Column(Integer, nullable=True)
     output_tokens = Column(Integer, nullable=True)
     total_tokens = Column(Integer, nullable=True)
-    cost_usd = Column(DECIMAL(10, 6), nullable=True)
+    cost_micro_usd = Column(BigInteger, nullable=True)  # 1 = $0.000001
     latency_ms = Column(Integer, nullable=True)
-    status = Column(String(20), nullable=False)  # 'success', 'error', 'timeout'
+    status = Column(String(20), nullable=False)  # 'success', 'client_disconnected', 'error', 'timeout'
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    @hybrid_property
+    def cost_usd(self):
+        """Cost in dollars, derived from the integer micro-dollar column"""
+        if self.cost_micro_usd is None:
+            return None
+        return self.cost_micro_usd / 1_000_000
+    
+    @cost_usd.expression
+    def cost_usd(cls):
+        return cls.cost_micro_usd / 1_000_000
+    
+    __table_args__ = (
+        # Covers the per-user credits aggregation (index-only on Postgres)
+        Index(
+            "ix_requests_user_status",
+            "user_id",
+            "status",
+            postgresql_include=["provider", "cost_micro_usd"]
+        ),
+        # Per-user usage history, newest first
+        Index("ix_requests_user_created", "user_id", created_at.desc()),
+        # Rows arrive in created_at order, so a BRIN index covers time-range
+        # scans at a fraction of a B-tree's size
+        Index("ix_requests_created_brin", "created_at", postgresql_using="brin"),
+    )
 
 class ProviderCost(Base):
     __tablename__ = "provider_costs"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     provider = Column(String(50), nullable=False)
     model = Column(String(100), nullable=False)
-    input_cost_per_1k = Column(DECIMAL(10, 6), nullable=False)
-    output_cost_per_1k = Column(DECIMAL(10, 6), nullable=False)
+    # Micro-dollars per 1k tokens
+    input_micro_usd_per_1k = Column(BigInteger, nullable=False)
+    output_micro_usd_per_1k = Column(BigInteger, nullable=False)
     effective_date = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,42 +1,58 @@
 import httpx
+import orjson
 import os
 import time
-from typing import Dict, Any, Optional
-from app.schemas import ChatCompletionRequest, EmbeddingRequest
+from types import MappingProxyType
+from typing import AsyncIterator, Dict, Any, Mapping, Optional, Tuple
+from app.http_client import get_shared_client
+from app.schemas import ChatMessage, ChatCompletionRequest, EmbeddingRequest
+
+# Calling the compiled serializer directly skips model_dump()'s per-call overhead
+_MSG_SERIALIZER = ChatMessage.__pydantic_serializer__
 
 class BaseProvider:
-    def __init__(self, name: str, base_url: str, api_key: str):
+    # Namespace prefix stripped from model IDs before they are sent upstream
+    model_prefix = ""
+    
+    def __init__(self, name: str, base_url: str, api_key: str, client: Optional[httpx.AsyncClient] = None):
         self.name = name
         self.base_url = base_url
         self.api_key = api_key
-        self.client = httpx.AsyncClient(timeout=30.0)
-    
-    async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        raise NotImplementedError
-    
-    async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
-        raise NotImplementedError
-    
-    async def get_models(self) -> Dict[str, Any]:
-        raise NotImplementedError
-
-class VercelProvider(BaseProvider):
-    def __init__(self):
-        super().__init__(
-            name="vercel",
-            base_url="https://ai-gateway.vercel.sh/v1",
-            api_key=os.getenv("VERCEL_AI_GATEWAY_API_KEY", "")
-        )
-    
-    async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        headers = {
+        self.client = client or get_shared_client()
+        # Static per provider, so built once rather than on every call
+        self._headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._chat_url = f"{base_url}/chat/completions"
+        self._embed_url = f"{base_url}/embeddings"
+    
+    async def _post_json(self, url: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """POST a JSON payload and return the decoded response and its latency in ms"""
+        start_ns = time.perf_counter_ns()
+        response = await self.client.post(url, headers=self._headers, content=orjson.dumps(payload))
+        latency_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
         
+        response.raise_for_status()
+        return orjson.loads(response.content), latency_ms
+    
+    def _provider_metadata(self, latency_ms: int, routed: bool = True) -> Dict[str, Any]:
+        """Gateway metadata attached to every provider response"""
+        gateway = {
+            "provider": self.name,
+            "latency": latency_ms
+        }
+        if routed:
+            gateway["routing"] = {
+                "selected_provider": self.name
+            }
+        return {"gateway": gateway}
+    
+    def _chat_payload(self, request: ChatCompletionRequest) -> Dict[str, Any]:
         payload = {
-            "model": request.model,
-            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
+            "model": request.model.removeprefix(self.model_prefix),
+            # Forward the full OpenAI message (name, tool_calls, extras), minus unset fields
+            "messages": [_MSG_SERIALIZER.to_python(msg, exclude_none=True) for msg in request.messages],
             "stream": request.stream,
             "temperature": request.temperature,
         }
@@ -44,204 +60,128 @@ class VercelProvider(BaseProvider):
         if request.max_tokens:
             payload["max_tokens"] = request.max_tokens
         
-        start_time = time.time()
-        response = await self.client.post(
-            f"{self.base_url}/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        # Add provider metadata
-        result["providerMetadata"] = {
-            "gateway": {
-                "provider": self.name,
-                "latency": latency_ms,
-                "routing": {
-                    "selected_provider": self.name
-                }
-            }
-        }
-        
+        return payload
+    
+    def _chat_response(self, request: ChatCompletionRequest, result: Dict[str, Any], latency_ms: int) -> Dict[str, Any]:
+        """Turn the upstream response into an OpenAI chat completion"""
+        result["providerMetadata"] = self._provider_metadata(latency_ms)
         return result
     
-    async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
+        payload = self._chat_payload(request)
+        result, latency_ms = await self._post_json(self._chat_url, payload)
+        return self._chat_response(request, result, latency_ms)
+    
+    async def chat_completion_stream(self, request: ChatCompletionRequest) -> AsyncIterator[str]:
+        """Yield the provider's raw SSE lines as they arrive"""
+        payload = self._chat_payload(request)
+        payload["stream"] = True
+        # Ask for a final usage chunk so the stream can be costed
+        payload["stream_options"] = {"include_usage": True}
         
+        async with self.client.stream(
+            "POST",
+            self._chat_url,
+            headers=self._headers,
+            content=orjson.dumps(payload)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                yield line
+    
+    async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
         payload = {
-            "model": request.model,
+            "model": request.model.removeprefix(self.model_prefix),
             "input": request.input
         }
         
-        start_time = time.time()
-        response = await self.client.post(
-            f"{self.base_url}/embeddings",
-            headers=headers,
-            json=payload
-        )
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        # Add provider metadata
-        result["providerMetadata"] = {
-            "gateway": {
-                "provider": self.name,
-                "latency": latency_ms
-            }
-        }
-        
+        result, latency_ms = await self._post_json(self._embed_url, payload)
+        result["providerMetadata"] = self._provider_metadata(latency_ms, routed=False)
         return result
     
     async def get_models(self) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = await self.client.get(f"{self.base_url}/models", headers=headers)
+        response = await self.client.get(f"{self.base_url}/models", headers=self._headers)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
+
+class VercelProvider(BaseProvider):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        super().__init__(
+            name="vercel",
+            base_url="https://ai-gateway.vercel.sh/v1",
+            api_key=os.getenv("VERCEL_AI_GATEWAY_API_KEY", ""),
+            client=client
+        )
 
 class OpenAIProvider(BaseProvider):
-    def __init__(self):
+    model_prefix = "openai/"
+    
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         super().__init__(
             name="openai",
             base_url="https://api.openai.com/v1",
-            api_key=os.getenv("OPENAI_API_KEY", "")
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            client=client
         )
-    
-    async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": request.model.replace("openai/", ""),  # Remove prefix
-            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-            "stream": request.stream,
-            "temperature": request.temperature,
-        }
-        
-        if request.max_tokens:
-            payload["max_tokens"] = request.max_tokens
-        
-        start_time = time.time()
-        response = await self.client.post(
-            f"{self.base_url}/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        # Add provider metadata
-        result["providerMetadata"] = {
-            "gateway": {
-                "provider": self.name,
-                "latency": latency_ms,
-                "routing": {
-                    "selected_provider": self.name
-                }
-            }
-        }
-        
-        return result
-    
-    async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": request.model.replace("openai/", ""),  # Remove prefix
-            "input": request.input
-        }
-        
-        start_time = time.time()
-        response = await self.client.post(
-            f"{self.base_url}/embeddings",
-            headers=headers,
-            json=payload
-        )
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        # Add provider metadata
-        result["providerMetadata"] = {
-            "gateway": {
-                "provider": self.name,
-                "latency": latency_ms
-            }
-        }
-        
-        return result
-    
-    async def get_models(self) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = await self.client.get(f"{self.base_url}/models", headers=headers)
-        response.raise_for_status()
-        return response.json()
+
+# Anthropic has no models endpoint; this static, read-only listing is shared
+# by every get_models() call
+_ANTHROPIC_MODELS = MappingProxyType({
+    "object": "list",
+    "data": (
+        MappingProxyType({
+            "id": "anthropic/claude-3-sonnet-20240229",
+            "object": "model",
+            "created": 1677610602,
+            "owned_by": "anthropic"
+        }),
+        MappingProxyType({
+            "id": "anthropic/claude-3-haiku-20240307",
+            "object": "model",
+            "created": 1677610602,
+            "owned_by": "anthropic"
+        })
+    )
+})
 
 class AnthropicProvider(BaseProvider):
-    def __init__(self):
+    model_prefix = "anthropic/"
+    
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         super().__init__(
             name="anthropic",
             base_url="https://api.anthropic.com/v1",
-            api_key=os.getenv("ANTHROPIC_API_KEY", "")
+            api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+            client=client
         )
-    
-    async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        headers = {
+        self._chat_url = f"{self.base_url}/messages"
+        self._headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json",
             "anthropic-version": "2023-06-01"
         }
-        
+    
+    def _chat_payload(self, request: ChatCompletionRequest) -> Dict[str, Any]:
         # Convert OpenAI format to Anthropic format
-        model = request.model.replace("anthropic/", "")
+        model = request.model.removeprefix(self.model_prefix)
+        # Anthropic rejects unknown message fields, so only role/content are sent
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
         
-        payload = {
+        return {
             "model": model,
             "messages": messages,
             "max_tokens": request.max_tokens or 1000,
             "temperature": request.temperature,
         }
-        
-        start_time = time.time()
-        response = await self.client.post(
-            f"{self.base_url}/messages",
-            headers=headers,
-            json=payload
-        )
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        response.raise_for_status()
-        result = response.json()
-        
+    
+    def _chat_response(self, request: ChatCompletionRequest, result: Dict[str, Any], latency_ms: int) -> Dict[str, Any]:
         # Convert Anthropic response to OpenAI format
-        openai_response = {
-            "id": f"chatcmpl-{int(time.time())}",
+        now = int(time.time())
+        usage = result["usage"]
+        return {
+            "id": f"chatcmpl-{now}",
             "object": "chat.completion",
-            "created": int(time.time()),
+            "created": now,
             "model": request.model,
             "choices": [{
                 "index": 0,
@@ -252,43 +192,83 @@ class AnthropicProvider(BaseProvider):
                 "finish_reason": "stop"
             }],
             "usage": {
-                "prompt_tokens": result["usage"]["input_tokens"],
-                "completion_tokens": result["usage"]["output_tokens"],
-                "total_tokens": result["usage"]["input_tokens"] + result["usage"]["output_tokens"]
+                "prompt_tokens": usage["input_tokens"],
+                "completion_tokens": usage["output_tokens"],
+                "total_tokens": usage["input_tokens"] + usage["output_tokens"]
             },
-            "providerMetadata": {
-                "gateway": {
-                    "provider": self.name,
-                    "latency": latency_ms,
-                    "routing": {
-                        "selected_provider": self.name
-                    }
-                }
-            }
+            "providerMetadata": self._provider_metadata(latency_ms)
         }
+    
+    async def chat_completion_stream(self, request: ChatCompletionRequest) -> AsyncIterator[str]:
+        """Translate Anthropic's event stream into OpenAI-format SSE lines"""
+        payload = self._chat_payload(request)
+        payload["stream"] = True
+        
+        created = int(time.time())
+        chunk_id = f"chatcmpl-{created}"
+        
+        def sse(choices: list, **extra: Any) -> str:
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.model,
+                "choices": choices,
+                **extra
+            }
+            return f"data: {orjson.dumps(chunk).decode()}"
         
-        return openai_response
+        input_tokens = 0
+        async with self.client.stream(
+            "POST",
+            self._chat_url,
+            headers=self._headers,
+            content=orjson.dumps(payload)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = orjson.loads(line[6:])
+                event_type = event.get("type")
+                
+                if event_type == "message_start":
+                    input_tokens = event["message"]["usage"]["input_tokens"]
+                    yield sse([{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}])
+                elif event_type == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                    yield sse([{"index": 0, "delta": {"content": event["delta"]["text"]}, "finish_reason": None}])
+                elif event_type == "message_delta":
+                    stop_reason = event["delta"].get("stop_reason")
+                    output_tokens = event["usage"]["output_tokens"]
+                    yield sse([{
+                        "index": 0,
+                        "delta": {},
+                        "finish_reason": "length" if stop_reason == "max_tokens" else "stop"
+                    }])
+                    yield ""
+                    yield sse([], usage={
+                        "prompt_tokens": input_tokens,
+                        "completion_tokens": output_tokens,
+                        "total_tokens": input_tokens + output_tokens
+                    })
+                elif event_type == "message_stop":
+                    yield "data: [DONE]"
+                elif event_type == "error":
+                    # Mid-stream failure (e.g. overloaded_error); fail the stream
+                    # rather than end it silently without usage
+                    error = event.get("error") or {}
+                    raise RuntimeError(
+                        f"Anthropic stream error ({error.get('type', 'unknown')}): {error.get('message', '')}"
+                    )
+                else:
+                    continue
+                # Blank line terminates each SSE event
+                yield ""
     
     async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
         # Anthropic doesn't have embeddings, return error
         raise NotImplementedError("Anthropic doesn't support embeddings")
     
-    async def get_models(self) -> Dict[str, Any]:
+    async def get_models(self) -> Mapping[str, Any]:
         # Return Anthropic models in OpenAI format
-        return {
-            "object": "list",
-            "data": [
-                {
-                    "id": "anthropic/claude-3-sonnet-20240229",
-                    "object": "model",
-                    "created": 1677610602,
-                    "owned_by": "anthropic"
-                },
-                {
-                    "id": "anthropic/claude-3-haiku-20240307",
-                    "object": "model",
-                    "created": 1677610602,
-                    "owned_by": "anthropic"
-                }
-            ]
-        }
+        return _ANTHROPIC_MODELS
@@ -0,0 +1,136 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from app.database import SessionLocal
+from app.models import Request
+from typing import Dict, Any, List
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Request logs are queued here and written in batches by run_request_log_writer()
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.1  # seconds
+# Bounded so a database outage can't grow the queue without limit
+LOG_QUEUE_MAX = 100_000
+# Back-off between write attempts while the database is unreachable
+LOG_RETRY_MIN = 0.5  # seconds
+LOG_RETRY_MAX = 30.0  # seconds
+log_queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=LOG_QUEUE_MAX)
+dropped_request_logs = 0
+
+def _count_dropped(count: int) -> None:
+    global dropped_request_logs
+    before = dropped_request_logs
+    dropped_request_logs += count
+    # Report the first drop and then every 1000th, not every row
+    if before == 0 or before // 1000 != dropped_request_logs // 1000:
+        logger.error("Dropped %d request log(s) so far", dropped_request_logs)
+
+def enqueue_request_log(row: Dict[str, Any]) -> None:
+    """Queue a request log row for the writer, counting it as dropped if the queue is full"""
+    try:
+        log_queue.put_nowait(row)
+    except asyncio.QueueFull:
+        _count_dropped(1)
+
+def _is_connection_error(exc: Exception) -> bool:
+    """True when the database itself is unreachable, as opposed to a bad row"""
+    return isinstance(exc, (OperationalError, InterfaceError)) or (
+        isinstance(exc, DBAPIError) and exc.connection_invalidated
+    )
+
+def _write_request_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert a batch of request log rows as one multi-row INSERT and commit
+    
+    Returns the rows still to be written when the database is unreachable.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            db.execute(insert(Request), batch)
+            db.commit()
+            return []
+        except Exception as e:
+            db.rollback()
+            if _is_connection_error(e):
+                return batch
+            logger.exception("Batch insert of %d request log(s) failed; retrying row by row", len(batch))
+        
+        # One bad row must not take the rest of the batch (other users'
+        # billing rows) down with it
+        for i, row in enumerate(batch):
+            try:
+                db.execute(insert(Request), row)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if _is_connection_error(e):
+                    return batch[i:]
+                logger.exception("Dropping request log row: %r", row)
+                _count_dropped(1)
+        return []
+    finally:
+        db.close()
+
+async def run_request_log_writer() -> None:
+    """Drain the request log queue, committing up to LOG_BATCH_SIZE rows at a time"""
+    loop = asyncio.get_running_loop()
+    backoff = 0.0
+    while True:
+        if backoff:
+            await asyncio.sleep(backoff)
+        
+        batch = [await log_queue.get()]
+        try:
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(log_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Hand the partial batch back so flush_request_log() can write it
+            for row in batch:
+                enqueue_request_log(row)
+            raise
+        
+        try:
+            unwritten = await asyncio.to_thread(_write_request_batch, batch)
+        except Exception:
+            logger.exception("Dropping %d request log(s)", len(batch))
+            _count_dropped(len(batch))
+            unwritten = []
+        
+        if unwritten:
+            # Database unreachable: keep the rows and retry with back-off
+            backoff = min(max(backoff * 2, LOG_RETRY_MIN), LOG_RETRY_MAX)
+            logger.warning(
+                "Request log database unavailable; retrying %d row(s) in %.1fs",
+                len(unwritten), backoff
+            )
+            for row in unwritten:
+                enqueue_request_log(row)
+        else:
+            backoff = 0.0
+
+async def flush_request_log() -> None:
+    """Write any request logs still queued (called on shutdown)"""
+    batch = []
+    while not log_queue.empty():
+        batch.append(log_queue.get_nowait())
+    
+    # Keep each INSERT to LOG_BATCH_SIZE rows
+    for i in range(0, len(batch), LOG_BATCH_SIZE):
+        try:
+            unwritten = await asyncio.to_thread(_write_request_batch, batch[i:i + LOG_BATCH_SIZE])
+        except Exception:
+            logger.exception("Failed to flush request logs on shutdown")
+            unwritten = batch[i:i + LOG_BATCH_SIZE]
+        if unwritten:
+            # No time left to retry; account for everything not yet written
+            _count_dropped(len(unwritten) + max(len(batch) - (i + LOG_BATCH_SIZE), 0))
+            return
@@ -1,24 +1,39 @@
-from app.providers import VercelProvider
+from app.providers import BaseProvider, VercelProvider
 from app.schemas import ChatCompletionRequest, EmbeddingRequest
-from typing import Dict, Any
-import random
+from typing import AsyncIterator, Dict, Any, Optional
+import functools
+import httpx
+
+@functools.cache
+def _vercel() -> VercelProvider:
+    """Default Vercel provider on the shared client, built on first use"""
+    return VercelProvider()
 
 class ProviderRouter:
-    def __init__(self):
-        self.providers = {
-            "vercel": VercelProvider()
-        }
-        
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self._client = client
+    
+    @functools.cached_property
+    def providers(self) -> Dict[str, BaseProvider]:
+        """Providers (and their HTTP client) are created on first request, not at import"""
         # Only use Vercel for all models
-        self.routing_preferences = {
-            "anthropic/claude": ["vercel"],
-            "openai/gpt": ["vercel"],
-            "anthropic/claude-sonnet": ["vercel"],
-            "anthropic/claude-haiku": ["vercel"],
-            "openai/gpt-4": ["vercel"],
-            "openai/gpt-3.5": ["vercel"]
+        return {
+            "vercel": VercelProvider(self._client) if self._client else _vercel()
         }
     
+    async def close(self):
+        """Close the upstream HTTP client shared by the providers, if one was created"""
+        if "providers" in self.__dict__:
+            await self.providers["vercel"].client.aclose()
+        elif self._client is not None:
+            await self._client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
     def select_provider(self, model: str) -> str:
         """Always select Vercel"""
         return "vercel"
@@ -26,31 +41,22 @@ class ProviderRouter:
     async def chat_completion(self, request: ChatCompletionRequest) -> Dict[str, Any]:
         """Route chat completion request to Vercel"""
         provider = self.providers["vercel"]
-        
-        try:
-            result = await provider.chat_completion(request)
-            return result
-        except Exception as e:
-            raise e
+        return await provider.chat_completion(request)
+    
+    def chat_completion_stream(self, request: ChatCompletionRequest) -> AsyncIterator[str]:
+        """Route streaming chat completion request to Vercel"""
+        provider = self.providers["vercel"]
+        return provider.chat_completion_stream(request)
     
     async def embedding(self, request: EmbeddingRequest) -> Dict[str, Any]:
         """Route embedding request to Vercel"""
         provider = self.providers["vercel"]
-        
-        try:
-            result = await provider.embedding(request)
-            return result
-        except Exception as e:
-            raise e
+        return await provider.embedding(request)
     
     async def get_models(self) -> Dict[str, Any]:
         """Get models from Vercel"""
-        try:
-            provider = self.providers["vercel"]
-            models_response = await provider.get_models()
-            return models_response
-        except Exception as e:
-            raise e
+        provider = self.providers["vercel"]
+        return await provider.get_models()
     
     def get_provider(self, provider_name: str):
         """Get a specific provider instance"""
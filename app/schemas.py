@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 from uuid import UUID
@@ -11,8 +11,7 @@ class ChatMessage(BaseModel):
     tool_calls: Optional[List[Dict[str, Any]]] = None
     tool_call_id: Optional[str] = None
     
-    class Config:
-        extra = "allow"  # Allow additional fields for compatibility
+    model_config = ConfigDict(extra="allow")  # Allow additional fields for compatibility
 
 class ChatCompletionRequest(BaseModel):
     model: str
@@ -27,8 +26,7 @@ class ChatCompletionRequest(BaseModel):
     n: Optional[int] = Field(default=1, ge=1)
     user: Optional[str] = None
     
-    class Config:
-        extra = "allow"  # Allow additional fields for compatibility
+    model_config = ConfigDict(extra="allow")  # Allow additional fields for compatibility
 
 class ChatCompletionResponse(BaseModel):
     id: str
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from app.models import Base
+from app.migrations import upgrade_schema
 import os
 from dotenv import load_dotenv
 import sys
@@ -15,6 +16,8 @@ def setup_database():
         
         # Create all tables
         Base.metadata.create_all(bind=engine)
+        # Bring tables created by older versions up to date
+        upgrade_schema(engine)
         
         print("Database tables created successfully!")
         return True
@@ -0,0 +1,4 @@
+import os
+
+# The app builds its engine at import; unit tests never touch a real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
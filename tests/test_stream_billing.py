@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import httpx
+import orjson
+import pytest
+
+import app.cost_tracker as cost_tracker
+import app.main as main
+from app.auth import AuthenticatedUser, get_current_user
+from app.database import get_db
+from app.models import uuid7
+from app.request_logger import log_queue
+
+PROMPT = "hello hello hello"
+UPSTREAM_USAGE = {"prompt_tokens": 11, "completion_tokens": 10, "total_tokens": 21}
+
+def _sse(data: dict) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+def _upstream(fail_after: int = None):
+    """Mock Vercel transport streaming ten slow content chunks, then usage"""
+    async def body():
+        yield _sse({"id": "up", "choices": [{"index": 0, "delta": {"role": "assistant"}}]})
+        for i in range(10):
+            await asyncio.sleep(0.05)
+            if fail_after is not None and i == fail_after:
+                raise httpx.ReadError("upstream connection lost")
+            yield _sse({"id": "up", "choices": [{"index": 0, "delta": {"content": f"word{i} "}}]})
+        yield _sse({"id": "up", "choices": [], "usage": UPSTREAM_USAGE})
+        yield b"data: [DONE]\n\n"
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+    
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """The app with auth and DB stubbed out and pricing pinned to the defaults"""
+    def no_db():
+        yield None
+    
+    main.app.dependency_overrides[get_current_user] = lambda: AuthenticatedUser(uuid7(), "test@example.com", None)
+    main.app.dependency_overrides[get_db] = no_db
+    monkeypatch.setattr(cost_tracker, "_pricing", {})
+    monkeypatch.setattr(cost_tracker, "_pricing_loaded_at", time.monotonic())
+    while not log_queue.empty():
+        log_queue.get_nowait()
+    yield main.router.providers["vercel"]
+    main.app.dependency_overrides.clear()
+
+async def _stream_then_disconnect(disconnect_after: int) -> int:
+    """POST a streaming chat request over raw ASGI, disconnecting after N content chunks"""
+    body = orjson.dumps({
+        "model": "openai/gpt-4",
+        "stream": True,
+        "messages": [{"role": "user", "content": PROMPT}]
+    })
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    disconnected = asyncio.Event()
+    delivered = 0
+    
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        nonlocal delivered
+        if message["type"] == "http.response.body" and b'"content"' in message.get("body", b""):
+            delivered += 1
+            if delivered == disconnect_after:
+                disconnected.set()
+    
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v1/chat/completions",
+        "raw_path": b"/v1/chat/completions",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"authorization", b"Bearer test")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    await asyncio.wait_for(main.app(scope, receive, send), timeout=5)
+    return delivered
+
+async def _logged_row() -> dict:
+    """Wait for the stream finisher and return the single queued request log row"""
+    for _ in range(100):
+        if main._stream_finishers:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.wait_for(asyncio.gather(*main._stream_finishers), timeout=5)
+    assert log_queue.qsize() == 1
+    return log_queue.get_nowait()
+
+@pytest.mark.asyncio
+async def test_disconnected_stream_is_billed_with_upstream_usage(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "client", _upstream())
+    
+    assert await _stream_then_disconnect(disconnect_after=3) == 3
+    row = await _logged_row()
+    
+    assert row["status"] == "client_disconnected"
+    assert row["request_type"] == "chat_stream"
+    assert (row["input_tokens"], row["output_tokens"], row["total_tokens"]) == (11, 10, 21)
+    assert row["cost_micro_usd"] == 11 * 1000 + 10 * 2000  # default vercel pricing
+
+@pytest.mark.asyncio
+async def test_disconnected_stream_falls_back_to_estimate_when_upstream_fails(gateway, monkeypatch):
+    # Upstream dies after the client has already gone (3 chunks delivered)
+    monkeypatch.setattr(gateway, "client", _upstream(fail_after=5))
+    
+    assert await _stream_then_disconnect(disconnect_after=3) == 3
+    row = await _logged_row()
+    
+    # ~4 chars per token over the prompt and the content actually delivered
+    delivered = "word0 word1 word2 "
+    prompt_tokens = -(-len(PROMPT) // 4)
+    completion_tokens = -(-len(delivered) // 4)
+    assert row["status"] == "client_disconnected"
+    assert (row["input_tokens"], row["output_tokens"]) == (prompt_tokens, completion_tokens)
+    assert row["cost_micro_usd"] == prompt_tokens * 1000 + completion_tokens * 2000